@@ -0,0 +1,13 @@
+import pytest
+
+try:
+    import uvloop
+except ImportError:  # optional (uvicorn[standard] pulls it in on Linux/macOS); tests then use asyncio's loop
+    uvloop = None
+
+
+if uvloop is not None:
+    @pytest.hookimpl(optionalhook=True)
+    def pytest_asyncio_loop_factories(config, item):
+        # run the async tests on uvloop, which schedules awaits with less overhead
+        return {"uvloop": uvloop.new_event_loop}
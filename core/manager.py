@@ -1,51 +1,107 @@
+import asyncio
+import orjson
 from fastapi import WebSocket
-from typing import Dict
+from typing import Callable, Dict, List
 from utils.logger import logger
 
+# max websockets flushed concurrently before yielding to the event loop
+BROADCAST_CHUNK_SIZE = 50
+
 
 class ConnectionManager:
     def __init__(self):
-        # symbol -> set of websockets
-        self.market_conns: Dict[str, set] = {}
-        self.trade_conns: Dict[str, set] = {}
+        # symbol -> websockets; plain lists since broadcasts only iterate them
+        self.market_conns: Dict[str, List[WebSocket]] = {}
+        self.trade_conns: Dict[str, List[WebSocket]] = {}
+        self.bbo_conns: Dict[str, List[WebSocket]] = {}
+        self.l2_conns: Dict[str, List[WebSocket]] = {}
 
     async def connect_market(self, symbol: str, websocket: WebSocket):
         await websocket.accept()
-        self.market_conns.setdefault(symbol, set()).add(websocket)
+        self.market_conns.setdefault(symbol, []).append(websocket)
         logger.info(f"Market ws connected: {symbol} total={len(self.market_conns[symbol])}")
 
     async def connect_trades(self, symbol: str, websocket: WebSocket):
         await websocket.accept()
-        self.trade_conns.setdefault(symbol, set()).add(websocket)
+        self.trade_conns.setdefault(symbol, []).append(websocket)
         logger.info(f"Trades ws connected: {symbol} total={len(self.trade_conns[symbol])}")
 
+    async def connect_bbo(self, symbol: str, websocket: WebSocket):
+        await websocket.accept()
+        self.bbo_conns.setdefault(symbol, []).append(websocket)
+        logger.info(f"BBO ws connected: {symbol} total={len(self.bbo_conns[symbol])}")
+
+    async def connect_l2(self, symbol: str, websocket: WebSocket, snapshot: Callable[[], dict]):
+        # register, then take the snapshot with no await in between, so every change
+        # after it reaches this socket as a delta; deltas carry absolute sizes,
+        # so one overlapping the snapshot is harmless
+        await websocket.accept()
+        self.l2_conns.setdefault(symbol, []).append(websocket)
+        message = {"type": "l2_snapshot", **snapshot()}
+        logger.info(f"L2 ws connected: {symbol} total={len(self.l2_conns[symbol])}")
+        await websocket.send_text(orjson.dumps(message).decode())
+
     def disconnect(self, websocket: WebSocket):
-        for d in (self.market_conns, self.trade_conns):
-            for symbol, conns in list(d.items()):
+        for d in (self.market_conns, self.trade_conns, self.bbo_conns, self.l2_conns):
+            for symbol, conns in d.items():
                 if websocket in conns:
                     conns.remove(websocket)
                     logger.info(f"Disconnected ws for {symbol}, remaining={len(conns)}")
 
+    @staticmethod
+    async def _send(ws: WebSocket, payload: str, failed: List[WebSocket]):
+        try:
+            await ws.send_text(payload)
+        except Exception:
+            failed.append(ws)
+
+    async def _send_all(self, conns: List[WebSocket], message: dict):
+        # serialize once for every subscriber, then flush in concurrent chunks,
+        # yielding to the event loop between chunks so large fanouts don't starve it
+        # orjson emits bytes; decode once so clients keep receiving text frames
+        payload = orjson.dumps(message).decode()
+        failed: List[WebSocket] = []
+        n = len(conns)
+        if n <= BROADCAST_CHUNK_SIZE:
+            # coroutines are created before the first await, so the live list needs no copy
+            await asyncio.gather(*(self._send(ws, payload, failed) for ws in conns))
+        else:
+            # we yield between chunks, so a disconnect could shift the live list under us
+            snapshot = tuple(conns)
+            for start in range(0, n, BROADCAST_CHUNK_SIZE):
+                batch = snapshot[start:start + BROADCAST_CHUNK_SIZE]
+                await asyncio.gather(*(self._send(ws, payload, failed) for ws in batch))
+                await asyncio.sleep(0)
+        # drop dead sockets only after the fanout is done
+        for ws in failed:
+            self.disconnect(ws)
+
     async def broadcast_market(self, symbol: str, message: dict):
-        conns = self.market_conns.get(symbol, set()).copy()
+        conns = self.market_conns.get(symbol)
         if not conns:
             return
-        logger.debug(f"Broadcast market {symbol} to {len(conns)} clients")
-        for ws in list(conns):
-            try:
-                await ws.send_json({"type": "l2_update", **message})
-            except Exception:
-                self.disconnect(ws)
-
-    async def broadcast_trade(self, symbol: str, message: dict):
-        conns = self.trade_conns.get(symbol, set()).copy()
+        logger.debug("Broadcast market %s to %d clients", symbol, len(conns))
+        await self._send_all(conns, {"type": "l2_update", **message})
+
+    async def broadcast_trades(self, symbol: str, trades: List[dict]):
+        conns = self.trade_conns.get(symbol)
+        if not conns:
+            return
+        logger.debug("Broadcast %d trades %s to %d clients", len(trades), symbol, len(conns))
+        await self._send_all(conns, {"type": "trades_batch", "symbol": symbol, "trades": trades})
+
+    async def broadcast_bbo(self, symbol: str, message: dict):
+        conns = self.bbo_conns.get(symbol)
+        if not conns:
+            return
+        logger.debug("Broadcast bbo %s to %d clients", symbol, len(conns))
+        await self._send_all(conns, {"type": "bbo", **message})
+
+    async def broadcast_l2(self, symbol: str, changes: List[dict]):
+        conns = self.l2_conns.get(symbol)
         if not conns:
             return
-        logger.debug(f"Broadcast trade {symbol} to {len(conns)} clients")
-        for ws in list(conns):
-            try:
-                await ws.send_json({"type": "trade", **message})
-            except Exception:
-                self.disconnect(ws)
+        logger.debug("Broadcast %d l2 changes %s to %d clients", len(changes), symbol, len(conns))
+        await self._send_all(conns, {"type": "l2_delta", "symbol": symbol, "changes": changes})
 
 manager = ConnectionManager()
\ No newline at end of file
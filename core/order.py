@@ -1,53 +1,287 @@
-import uuid
-from datetime import datetime
+import itertools
+import time
+from collections import deque
+from functools import lru_cache
 from decimal import Decimal, getcontext, ROUND_DOWN
-from dataclasses import dataclass
-from typing import Optional
-from pydantic import BaseModel, Field
+from dataclasses import dataclass, field
+from typing import Callable, ClassVar, Deque, Dict, Optional, Tuple
+from pydantic import BaseModel, ConfigDict, Field, PrivateAttr, model_validator
 
 # Decimal precision
 getcontext().prec = 18
 getcontext().rounding = ROUND_DOWN
 
+# Default number of decimals carried for prices / quantities
+DEFAULT_PRICE_DECIMALS = 8
+DEFAULT_QTY_DECIMALS = 8
+
+# symbol -> (price_scale, qty_scale); symbols not listed use the defaults
+symbol_meta: Dict[str, Tuple[int, int]] = {}
+
+# max released Order instances kept for reuse by Order.create
+ORDER_POOL_SIZE = 10_000
+
+# process-start prefix so counter-based ids stay unique across restarts
+RUN_ID = f"{time.time_ns():x}"
+_order_seq = itertools.count(1)
+
+def next_order_id() -> str:
+    """Unique order id from a process-wide counter (no uuid4 / urandom per order)."""
+    return f"{RUN_ID}-o{next(_order_seq)}"
+
 def D(x) -> Decimal:
     """Helper to convert to Decimal safely."""
     return Decimal(str(x))
 
+# whole-second prefix of the last formatted timestamp, reused within the same second
+_iso_second = -1
+_iso_prefix = ""
+
+def iso_from_ts(ts: float) -> str:
+    """UTC ISO-8601 string (microseconds, "Z" suffix) for a unix timestamp."""
+    global _iso_second, _iso_prefix
+    sec = int(ts)
+    if sec != _iso_second:
+        _iso_prefix = time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(sec))
+        _iso_second = sec
+    return f"{_iso_prefix}.{int((ts - sec) * 1_000_000):06d}Z"
+
 def now_iso():
     """Current UTC timestamp in ISO format."""
-    return datetime.utcnow().isoformat() + "Z"
+    return iso_from_ts(time.time())
+
+
+def _decimals(scale: int) -> int:
+    decimals = len(str(scale)) - 1
+    if scale != 10 ** decimals:
+        raise ValueError(f"scale must be a power of 10, got {scale}")
+    return decimals
+
+def _format_ticks(ticks: int, scale: int, decimals: int) -> str:
+    # integer-only equivalent of format(Decimal(ticks) / scale, "f")
+    sign = "-" if ticks < 0 else ""
+    whole, frac = divmod(abs(ticks), scale)
+    if not frac:
+        return f"{sign}{whole}"
+    return f"{sign}{whole}.{frac:0{decimals}d}".rstrip("0")
+
+# ticks are int64 inside the engine
+TICKS_MIN = -2 ** 63
+TICKS_MAX = 2 ** 63 - 1
+TICKS_MAX_DIGITS = len(str(TICKS_MAX))
+# longest number text accepted; generous for any int64 tick value with padding
+# zeros or an exponent, and it keeps oversized inputs out of the parse cache
+MAX_NUMBER_LEN = 64
+
+def _parse_ticks(x, decimals: int) -> int:
+    if len(x if isinstance(x, str) else str(x)) > MAX_NUMBER_LEN:
+        raise ValueError(f"number is longer than {MAX_NUMBER_LEN} characters")
+    return _parse_ticks_cached(x, decimals)
+
+# traffic clusters on a small set of price/quantity strings, so parsed ticks are memoized
+@lru_cache(maxsize=1 << 16)
+def _parse_ticks_cached(x, decimals: int) -> int:
+    # shift the decimal's digits in integer arithmetic; Decimal multiplication
+    # would round to the context precision (18 digits) and lose large values
+    sign, digits, exp = D(x).as_tuple()
+    if not isinstance(exp, int):
+        raise ValueError(f"{x} is not a finite number")
+    if not any(digits):
+        return 0
+    # bound the shift by digit counts before any 10 ** n is built, so a huge
+    # exponent is rejected up front instead of materializing a giant int
+    n = len(digits)  # no leading zeros for a nonzero coefficient
+    shift = exp + decimals
+    if n + shift > TICKS_MAX_DIGITS:
+        raise ValueError(f"{x} is out of range")
+    if shift < 0:
+        # the dropped digits must all be zero (this also covers -shift > n)
+        if -shift >= n or any(digits[shift:]):
+            raise ValueError(f"{x} has more decimals than supported")
+        digits = digits[:shift]
+        shift = 0
+    ticks = int("".join(map(str, digits))) * 10 ** shift
+    if sign:
+        ticks = -ticks
+    if not TICKS_MIN <= ticks <= TICKS_MAX:
+        raise ValueError(f"{x} is out of range")
+    return ticks
+
+
+class PriceQuantityConverter:
+    """
+    Converts decimal prices/quantities at the API boundary to the integer
+    ticks used inside the engine, and back to decimal strings for output.
+    """
+
+    def __init__(self, price_scale: int, qty_scale: int):
+        self.price_scale = price_scale
+        self.qty_scale = qty_scale
+        # price ticks * qty ticks
+        self.value_scale = price_scale * qty_scale
+        self.price_decimals = _decimals(price_scale)
+        self.qty_decimals = _decimals(qty_scale)
+        self.value_decimals = self.price_decimals + self.qty_decimals
+
+    def price_to_ticks(self, x) -> int:
+        return _parse_ticks(x, self.price_decimals)
+
+    def qty_to_ticks(self, x) -> int:
+        return _parse_ticks(x, self.qty_decimals)
+
+    # output formatting stays in integer arithmetic; no Decimal per trade/level
+    def price_str(self, ticks: int) -> str:
+        return _format_ticks(ticks, self.price_scale, self.price_decimals)
+
+    def qty_str(self, ticks: int) -> str:
+        return _format_ticks(ticks, self.qty_scale, self.qty_decimals)
 
-@dataclass
+    def value_str(self, ticks: int) -> str:
+        return _format_ticks(ticks, self.value_scale, self.value_decimals)
+
+
+# (price_scale, qty_scale) -> shared converter; converters are immutable after init
+_converters: Dict[Tuple[int, int], PriceQuantityConverter] = {}
+
+def get_converter(symbol: str) -> PriceQuantityConverter:
+    scales = symbol_meta.get(
+        symbol, (10 ** DEFAULT_PRICE_DECIMALS, 10 ** DEFAULT_QTY_DECIMALS)
+    )
+    conv = _converters.get(scales)
+    if conv is None:
+        conv = _converters[scales] = PriceQuantityConverter(*scales)
+    return conv
+
+
+@dataclass(slots=True)
 class Order:
-    """Internal order object for matching engine."""
+    """Internal order object for matching engine. Price/quantity are integer ticks."""
     id: str
     symbol: str
     side: str  # "buy" or "sell"
     order_type: str  # "market", "limit", "ioc", "fok", "stoploss"
-    quantity: Decimal
-    price: Optional[Decimal]
-    remaining: Decimal
+    quantity: int
+    price: Optional[int]
+    remaining: int
     timestamp: float
     created_at: str
+    # intrusive links to the neighbouring orders while resting in a PriceLevel
+    prev: Optional["Order"] = field(default=None, repr=False, compare=False)
+    next: Optional["Order"] = field(default=None, repr=False, compare=False)
+
+    # released instances, recycled by create() instead of allocating
+    _pool: ClassVar[Deque["Order"]] = deque(maxlen=ORDER_POOL_SIZE)
 
     @classmethod
-    def create(cls, symbol: str, side: str, order_type: str, quantity: Decimal, price: Optional[Decimal]):
-        now = datetime.utcnow()
+    def create(cls, symbol: str, side: str, order_type: str, quantity: int, price: Optional[int],
+               order_id: Optional[str] = None):
+        now = time.time()
+        if cls._pool:
+            order = cls._pool.pop()
+            order.id = order_id or next_order_id()
+            order.symbol = symbol
+            order.side = side
+            order.order_type = order_type
+            order.quantity = quantity
+            order.price = price
+            order.remaining = quantity
+            order.timestamp = now
+            order.created_at = iso_from_ts(now)
+            order.prev = order.next = None
+            return order
         return cls(
-            id=str(uuid.uuid4()),
+            id=order_id or next_order_id(),
             symbol=symbol,
             side=side,
             order_type=order_type,
             quantity=quantity,
             price=price,
             remaining=quantity,
-            timestamp=now.timestamp(),
-            created_at=now.isoformat() + "Z",
+            timestamp=now,
+            created_at=iso_from_ts(now),
         )
 
+    def release(self):
+        """
+        Hand the instance back to the pool; create() will reuse it for a later order.
+        The engine releases makers it fully filled and orders canceled off the book,
+        so any handle still held elsewhere (e.g. a caller's reference to a resting
+        order) must not be read after the release: it will show another order's data.
+        """
+        self._pool.append(self)
+
+# order types that cannot be accepted without a price -> validation message
+PRICE_REQUIRED = {
+    "limit": "Limit orders require a price",
+    "ioc": "ioc orders require a price, as its a limit ioc",
+    "fok": "fok orders require a price, as its a limit fok",
+    "stoploss": "Stop-loss orders require a trigger price",
+}
+
+def _positive_ticks(parse: Callable[[str], int], x: str, name: str) -> int:
+    """Convert a REST decimal string with parse(), requiring a positive result."""
+    try:
+        ticks = parse(x)
+    except Exception as e:
+        raise ValueError(f"Invalid {name}: {e}")
+    if ticks <= 0:
+        raise ValueError(f"Invalid {name}: {name} must be positive")
+    return ticks
+
 class OrderSubmission(BaseModel):
-    symbol: str = Field(..., example="BTC-USDT")
+    """
+    REST order payload. Quantity/price are validated and converted to the
+    symbol's integer ticks here, so handlers never parse decimals themselves.
+    """
+    model_config = ConfigDict(str_strip_whitespace=True)
+
+    symbol: str = Field(..., examples=["BTC-USDT"])
     order_type: str = Field(..., pattern="^(market|limit|ioc|fok|stoploss)$")
     side: str = Field(..., pattern="^(buy|sell)$")
-    quantity: str = Field(..., example="0.5")
-    price: Optional[str] = Field(None, example="30000")
+    quantity: str = Field(..., examples=["0.5"])
+    price: Optional[str] = Field(None, examples=["30000"])
+
+    _quantity_ticks: int = PrivateAttr(0)
+    _price_ticks: Optional[int] = PrivateAttr(None)
+
+    @model_validator(mode="after")
+    def _convert_to_ticks(self):
+        conv = get_converter(self.symbol)
+        qty = _positive_ticks(conv.qty_to_ticks, self.quantity, "quantity")
+
+        # only priced order types parse a price; market orders never carry one
+        price = None
+        if self.order_type in PRICE_REQUIRED:
+            if self.price is None:
+                raise ValueError(PRICE_REQUIRED[self.order_type])
+            price = _positive_ticks(conv.price_to_ticks, self.price, "price")
+
+        self._quantity_ticks = qty
+        self._price_ticks = price
+        return self
+
+    @property
+    def quantity_ticks(self) -> int:
+        return self._quantity_ticks
+
+    @property
+    def price_ticks(self) -> Optional[int]:
+        return self._price_ticks
+
+
+class OrderModification(BaseModel):
+    """
+    REST modify payload for a resting order or a pending stop (price is then the
+    trigger). It names no symbol, so the handler converts it with the book's
+    converter once the order is found; the checks are the same as OrderSubmission's.
+    """
+    model_config = ConfigDict(str_strip_whitespace=True)
+
+    quantity: Optional[str] = Field(None, examples=["0.5"])
+    price: Optional[str] = Field(None, examples=["30000"])
+
+    def to_ticks(self, conv: PriceQuantityConverter) -> Tuple[Optional[int], Optional[int]]:
+        """(quantity, price) ticks, None where unchanged; raises ValueError on bad input."""
+        qty = _positive_ticks(conv.qty_to_ticks, self.quantity, "quantity") if self.quantity else None
+        price = _positive_ticks(conv.price_to_ticks, self.price, "price") if self.price else None
+        return qty, price
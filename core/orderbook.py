@@ -1,287 +1,706 @@
 import asyncio
-from collections import deque
+import gc
+import logging
+from sortedcontainers import SortedKeyList, SortedList
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set, Tuple
 from decimal import Decimal
-import uuid
-from sortedcontainers import SortedDict
-from typing import Deque, Dict, Optional
-from core.order import Order, D, now_iso
+from core.order import D, RUN_ID, Order, PriceQuantityConverter, get_converter, now_iso
 from utils.logger import logger
 
+MAKER_FEE_BPS = -2  # -0.02% rebate
+TAKER_FEE_BPS = 10  # 0.1% fee
+
+class Trade:
+    """
+    One fill, as built by the match loop. Only what the fill itself decides is
+    stored (ints and references); value, fees and the decimal strings of the
+    wire format are derived by to_dict() when the batch is published.
+    """
+    __slots__ = ("timestamp", "symbol", "seq", "price", "qty", "maker_id", "taker_id", "aggressor", "converter")
+
+    def __init__(self, timestamp: str, symbol: str, seq: int, price: int, qty: int, maker_id: str,
+                 taker_id: str, aggressor: str, converter: PriceQuantityConverter):
+        self.timestamp = timestamp
+        self.symbol = symbol
+        self.seq = seq
+        self.price = price
+        self.qty = qty
+        self.maker_id = maker_id
+        self.taker_id = taker_id
+        self.aggressor = aggressor
+        self.converter = converter
+
+    @property
+    def trade_value(self) -> int:
+        return self.price * self.qty
+
+    @property
+    def maker_fee(self) -> int:
+        return self.trade_value * MAKER_FEE_BPS // 10000
+
+    @property
+    def taker_fee(self) -> int:
+        return self.trade_value * TAKER_FEE_BPS // 10000
+
+    # wire key -> formatter of that field: the one definition of the wire format,
+    # so item access can format a single field without building the whole dict
+    _WIRE_FIELDS: Dict[str, Callable[["Trade"], Any]] = {
+        "timestamp": lambda t: t.timestamp,
+        "symbol": lambda t: t.symbol,
+        "trade_id": lambda t: f"{RUN_ID}-{t.symbol}-{t.seq}",
+        "price": lambda t: t.converter.price_str(t.price),
+        "quantity": lambda t: t.converter.qty_str(t.qty),
+        "trade_value": lambda t: t.converter.value_str(t.trade_value),
+        "aggressor_side": lambda t: t.aggressor,
+        "maker_order_id": lambda t: t.maker_id,
+        "taker_order_id": lambda t: t.taker_id,
+        "maker_fee": lambda t: t.converter.value_str(t.maker_fee),
+        "taker_fee": lambda t: t.converter.value_str(t.taker_fee),
+    }
+
+    def to_dict(self) -> Dict:
+        return {key: fmt(self) for key, fmt in self._WIRE_FIELDS.items()}
+
+    def __getitem__(self, key: str):
+        # dict-style access to the formatted fields, for callers that want the wire shape
+        return self._WIRE_FIELDS[key](self)
+
+    def __repr__(self) -> str:
+        return f"Trade({self.to_dict()})"
+
+
 class PriceLevel:
+    """
+    FIFO of resting orders at one price, kept as an intrusive doubly-linked list
+    threaded through the orders' own prev/next slots (no per-order node object).
+    """
+    __slots__ = ("head", "tail", "total")
+
     def __init__(self):
-        self.queue: Deque[Order] = deque()
-        self.total: Decimal = D("0")
+        self.head: Optional[Order] = None  # oldest
+        self.tail: Optional[Order] = None  # newest
+        self.total: int = 0
+
+    def is_empty(self) -> bool:
+        return self.head is None
 
     def add(self, order: Order):
-        self.queue.append(order)
+        if self.tail is None:
+            self.head = order
+        else:
+            order.prev = self.tail
+            self.tail.next = order
+        self.tail = order
         self.total += order.remaining
 
-    def pop_oldest(self) -> Order:
-        order = self.queue[0]
-        return order
-
-    def remove_oldest(self) -> Order:
-        order = self.queue.popleft()
+    def unlink(self, order: Order):
+        # O(1) removal of any order, wherever it sits in the queue
+        if order.prev is None:
+            self.head = order.next
+        else:
+            order.prev.next = order.next
+        if order.next is None:
+            self.tail = order.prev
+        else:
+            order.next.prev = order.prev
+        order.prev = order.next = None
         self.total -= order.remaining
-        return order
 
-    def decrease_oldest(self, amount: Decimal):
-        # decrease remaining and total by amount
-        assert self.queue
-        oldest = self.queue[0]
-        if amount >= oldest.remaining:
-            self.total -= oldest.remaining
-            oldest.remaining = D("0")
-            self.queue.popleft()
-        else:
-            oldest.remaining -= amount
-            self.total -= amount
 
-class OrderBook:
-    def __init__(self, symbol: str):
+class SyncOrderBook:
+    """
+    Book state and the synchronous matching core, with no event loop involved.
+    Usable directly where a single thread owns the book (benchmarks, embedding);
+    the service uses OrderBook, which serializes access through a writer task.
+    """
+    def __init__(self, symbol: str, depth_band: int = 10):
         self.symbol = symbol
-        # SortedDict sorts ascending by key
-        self.asks: SortedDict = SortedDict()  # price -> PriceLevel (lowest first)
-        self.bids: SortedDict = SortedDict()  # price -> PriceLevel (lowest first) -> iterate in reverse for best bid
-        self.orders: Dict[str, Order] = {}  # id -> Order
-        self.lock = asyncio.Lock()
+        self.converter = get_converter(symbol)
+        # price ticks -> PriceLevel; sorted prices are kept alongside for depth/iteration
+        self.asks: Dict[int, PriceLevel] = {}
+        self.bids: Dict[int, PriceLevel] = {}
+        self.ask_prices: SortedList = SortedList()  # ascending, best ask first
+        self.bid_prices: SortedList = SortedList()  # ascending, best bid last
+        # cached top of book, maintained on level insert/remove
+        self._best_ask: Optional[int] = None
+        self._best_bid: Optional[int] = None
+        self.order_nodes: Dict[str, Order] = {}  # resting order id -> order (linked into its level)
         self.trade_seq = 0
+        # number of levels per side published as depth; changes below it don't invalidate the cache
+        self.depth_band = depth_band
+        # bumped whenever a level inside the band changes; guards the cached depth lists
+        self._depth_gen: Dict[str, int] = {"buy": 0, "sell": 0}
+        self._depth_cache: Dict[str, tuple] = {"buy": (-1, []), "sell": (-1, [])}  # side -> (gen, formatted levels)
+        self._levels_cache: Dict[str, tuple] = {"buy": (-1, ()), "sell": (-1, ())}  # side -> (gen, tick levels)
+        # prices whose level size changed since the last pop_l2_changes()
+        self._l2_changes: Dict[str, Set[int]] = {"buy": set(), "sell": set()}
+        # last top-of-book state handed to subscribers, to skip unchanged re-broadcasts
+        self._last_depth_gen: Optional[tuple] = None
+        self._last_depth_key: Optional[tuple] = None
+        self._last_bbo_key: Optional[tuple] = None
+        # pending stops per side, ordered so the next one to trigger is first:
+        # buy stops by ascending trigger, sell stops by descending trigger
+        self.stop_ladders: Dict[str, SortedKeyList] = {
+            "buy": SortedKeyList(key=lambda o: o.price),
+            "sell": SortedKeyList(key=lambda o: -o.price),
+        }
+        self.stop_ids: Dict[str, Order] = {}  # id -> pending stop order
+        # debug logging enabled for the current matching step (set by _match)
+        self._debug = False
+        # order type -> matcher specialized for it, so _match dispatches once per order
+        self._matchers: Dict[str, Callable[[Order], Dict]] = {
+            "market": self._match_market,
+            "limit": self._match_limit,
+            "ioc": self._match_ioc,
+            "fok": self._match_fok,
+            "stoploss": self._place_stop,
+        }
 
     # helper to ensure price level exists
-    def _ensure_level(self, container: SortedDict, price: Decimal) -> PriceLevel:
-        if price not in container:
-            container[price] = PriceLevel()
-        return container[price]
-
-    def _remove_price_if_empty(self, container: SortedDict, price: Decimal):
-        lvl = container.get(price)
-        if not lvl or len(lvl.queue) == 0:
-            if price in container:
-                del container[price]
-
-    def get_bbo(self) -> Dict:
-        best_bid = None
-        best_ask = None
-        if len(self.bids) > 0:
-            # best bid is last key (highest price)
-            bprice, blevel = self.bids.peekitem(-1)
-            best_bid = (str(bprice), str(blevel.total))
-        if len(self.asks) > 0:
-            aprice, alevel = self.asks.peekitem(0)
-            best_ask = (str(aprice), str(alevel.total))
-        return {"symbol": self.symbol, "best_bid": best_bid, "best_ask": best_ask, "timestamp": now_iso()}
-
-    def get_depth(self, depth: int = 10) -> Dict:
-        asks = []
-        bids = []
-        # asks: lowest -> higher
-        for i, (price, lvl) in enumerate(self.asks.items()):
-            if i >= depth:
-                break
-            asks.append([str(price), str(lvl.total)])
-        # bids: highest -> lower
-        # iterate reversed
-        n = 0
-        for price in reversed(self.bids.keys()):
-            if n >= depth:
-                break
-            lvl = self.bids[price]
-            bids.append([str(price), str(lvl.total)])
-            n += 1
-        return {"symbol": self.symbol, "asks": asks, "bids": bids, "timestamp": now_iso()}
+    def _ensure_level(self, side: str, price: int) -> PriceLevel:
+        container = self._same_book(side)
+        level = container.get(price)
+        if level is None:
+            level = container[price] = PriceLevel()
+            if side == "buy":
+                self.bid_prices.add(price)
+                if self._best_bid is None or price > self._best_bid:
+                    self._best_bid = price
+            else:
+                self.ask_prices.add(price)
+                if self._best_ask is None or price < self._best_ask:
+                    self._best_ask = price
+        return level
+
+    def _remove_level(self, side: str, price: int):
+        del self._same_book(side)[price]
+        if side == "buy":
+            if price == self._best_bid:
+                self.bid_prices.pop(-1)
+                self._best_bid = self.bid_prices[-1] if self.bid_prices else None
+            else:
+                self.bid_prices.remove(price)
+        else:
+            if price == self._best_ask:
+                self.ask_prices.pop(0)
+                self._best_ask = self.ask_prices[0] if self.ask_prices else None
+            else:
+                self.ask_prices.remove(price)
+
+    def _drop_best_levels(self, side: str, count: int):
+        # the `count` best price levels of `side` were emptied (and removed from
+        # the dict) by a sweep; drop them from the sorted prices in one go
+        if side == "buy":
+            del self.bid_prices[-count:]
+            self._best_bid = self.bid_prices[-1] if self.bid_prices else None
+        else:
+            del self.ask_prices[:count]
+            self._best_ask = self.ask_prices[0] if self.ask_prices else None
+
+    def _remove_price_if_empty(self, side: str, price: int):
+        lvl = self._same_book(side).get(price)
+        if lvl is not None and lvl.is_empty():
+            self._remove_level(side, price)
+
+    def _touch(self, side: str, price: int):
+        # level at `price` appeared, vanished or changed size; call while the
+        # price is still in (or already in) the sorted prices so its rank is right
+        self._l2_changes[side].add(price)
+        if side == "buy":
+            rank = len(self.bid_prices) - self.bid_prices.bisect_right(price)
+        else:
+            rank = self.ask_prices.bisect_left(price)
+        if rank < self.depth_band:
+            self._depth_gen[side] += 1
+
+    def rest_order(self, order: Order):
+        """Place an order on its side of the book at order.price."""
+        level = self._ensure_level(order.side, order.price)
+        level.add(order)
+        self.order_nodes[order.id] = order
+        self._touch(order.side, order.price)
+
+    def cancel_order(self, order_id: str) -> Optional[Order]:
+        """Remove a resting order from the book. Returns the order, or None if not resting."""
+        order = self.order_nodes.pop(order_id, None)
+        if order is None:
+            return None
+        self._same_book(order.side)[order.price].unlink(order)
+        self._touch(order.side, order.price)
+        self._remove_price_if_empty(order.side, order.price)
+        return order
 
-    def _opposite_book(self, side: str) -> SortedDict:
-        return self.asks if side == "buy" else self.bids
+    def modify_order(self, order_id: str, quantity: Optional[int], price: Optional[int]) -> Optional[Order]:
+        """Re-size and/or re-price a resting order; it is requeued at the back of its level."""
+        order = self.cancel_order(order_id)
+        if order is None:
+            return None
+        if quantity is not None:
+            order.quantity = quantity
+            order.remaining = quantity
+        if price is not None:
+            order.price = price
+        self.rest_order(order)
+        return order
 
-    def _same_book(self, side: str) -> SortedDict:
-        return self.bids if side == "buy" else self.asks
+    def add_stop(self, order: Order):
+        """Park a stop order until a trade crosses its trigger price (order.price)."""
+        self.stop_ladders[order.side].add(order)
+        self.stop_ids[order.id] = order
 
-    def _best_price_for_side(self, side: str) -> Optional[Decimal]:
-        if side == "buy":
-            if len(self.bids) == 0:
-                return None
-            return self.bids.peekitem(-1)[0]
-        else:
-            if len(self.asks) == 0:
-                return None
-            return self.asks.peekitem(0)[0]
-        
-    async def submit_order(self, order: Order, on_trade_callback=None) -> Dict:
+    def cancel_stop(self, order_id: str) -> Optional[Order]:
+        order = self.stop_ids.pop(order_id, None)
+        if order is not None:
+            self.stop_ladders[order.side].remove(order)
+        return order
+
+    def modify_stop(self, order_id: str, quantity: Optional[int], price: Optional[int]) -> Optional[Order]:
+        """Re-size and/or move the trigger of a pending stop."""
+        # the trigger price is the ladder key, so take the order out while updating it
+        order = self.cancel_stop(order_id)
+        if order is None:
+            return None
+        if quantity is not None:
+            order.quantity = quantity
+            order.remaining = quantity
+        if price is not None:
+            order.price = price
+        self.add_stop(order)
+        return order
+
+    def get_stops(self) -> List[Order]:
+        return [o for ladder in self.stop_ladders.values() for o in ladder]
+
+    def _pop_triggered_stops(self, high: int, low: int) -> List[Order]:
+        """Remove and return the stops crossed by trades spanning [low, high]."""
+        triggered = []
+        # Buy stop triggers if trade price >= stop price
+        # Sell stop triggers if trade price <= stop price
+        for ladder, bound in ((self.stop_ladders["buy"], high), (self.stop_ladders["sell"], -low)):
+            n = ladder.bisect_key_right(bound)
+            if n:
+                triggered.extend(ladder[:n])
+                del ladder[:n]
+        for o in triggered:
+            del self.stop_ids[o.id]
+        return triggered
+
+    def _fire_stops(self, trades: List[Trade]) -> List[Trade]:
         """
-        Submit an order. Returns dict describing order status and trades list (if any).
-        on_trade_callback(trade_dict) will be called for each executed trade (async or sync).
+        Run the stops crossed by trades as market orders, repeating while their
+        own fills cross further stops. Returns the trades the stops produced.
         """
-        
-        
-        async with self.lock:
-            logger.info(f"Submitting order {order.id} {order.side} {order.order_type} {order.quantity}@{order.price}")
+        stop_trades = []
+        while trades and self.stop_ids:
+            # a batch triggers the same stops as its highest / lowest trade price would
+            prices = [t.price for t in trades]
+            triggered = self._pop_triggered_stops(max(prices), min(prices))
+            if not triggered:
+                break
             trades = []
+            for o in triggered:
+                if self._debug:
+                    logger.debug("Stop order %s triggered -> market", o.id)
+                o.order_type = "market"
+                trades += self._match_market(o)["trades"]
+            stop_trades += trades
+        return stop_trades
+
+    def best_bid(self) -> Optional[Tuple[int, int]]:
+        """(price, size) ticks of the best bid level, or None if there are no bids."""
+        price = self._best_bid
+        return None if price is None else (price, self.bids[price].total)
+
+    def best_ask(self) -> Optional[Tuple[int, int]]:
+        """(price, size) ticks of the best ask level, or None if there are no asks."""
+        price = self._best_ask
+        return None if price is None else (price, self.asks[price].total)
+
+    def get_bbo(self, ts: Optional[str] = None) -> Dict:
+        conv = self.converter
+        best_bid = self.best_bid()
+        best_ask = self.best_ask()
+        if best_bid is not None:
+            best_bid = (conv.price_str(best_bid[0]), conv.qty_str(best_bid[1]))
+        if best_ask is not None:
+            best_ask = (conv.price_str(best_ask[0]), conv.qty_str(best_ask[1]))
+        return {"symbol": self.symbol, "best_bid": best_bid, "best_ask": best_ask, "timestamp": ts or now_iso()}
+
+    def _top_prices(self, side: str, depth: int):
+        if side == "buy":
+            # bids: highest -> lower
+            return self.bid_prices.islice(max(len(self.bid_prices) - depth, 0), reverse=True)
+        # asks: lowest -> higher
+        return self.ask_prices.islice(0, depth)
+
+    def _levels(self, side: str, depth: int) -> Tuple[Tuple[int, int], ...]:
+        """(price, size) ticks of the best `depth` levels of side, best first."""
+        cacheable = depth == self.depth_band
+        if cacheable:
+            gen, levels = self._levels_cache[side]
+            if gen == self._depth_gen[side]:
+                return levels
+        book = self._same_book(side)
+        levels = tuple([(p, book[p].total) for p in self._top_prices(side, depth)])
+        if cacheable:
+            self._levels_cache[side] = (self._depth_gen[side], levels)
+        return levels
+
+    def depth_snapshot(self, depth: Optional[int] = None) -> Dict[str, Tuple[Tuple[int, int], ...]]:
+        """
+        Top levels per side as (price, size) ticks, best first, for engine-side
+        consumers. The published band (the default) is cached and shared until
+        a level inside it changes, so polling it allocates nothing.
+        """
+        depth = self.depth_band if depth is None else max(depth, 0)
+        return {"bids": self._levels("buy", depth), "asks": self._levels("sell", depth)}
+
+    def _depth_side(self, side: str, depth: int) -> List[List[str]]:
+        cacheable = depth == self.depth_band
+        if cacheable:
+            gen, levels = self._depth_cache[side]
+            if gen == self._depth_gen[side]:
+                return levels
+        conv = self.converter
+        levels = [[conv.price_str(p), conv.qty_str(size)] for p, size in self._levels(side, depth)]
+        if cacheable:
+            self._depth_cache[side] = (self._depth_gen[side], levels)
+        return levels
+
+    def get_depth(self, depth: int = 10, ts: Optional[str] = None) -> Dict:
+        # the published band is served from a per-side cache rebuilt only when a level inside it changed
+        depth = max(depth, 0)
+        asks = self._depth_side("sell", depth)
+        bids = self._depth_side("buy", depth)
+        return {"symbol": self.symbol, "asks": asks, "bids": bids, "timestamp": ts or now_iso()}
+
+    def depth_changed(self) -> bool:
+        """True if the top `depth_band` levels (price, size) differ from the previous call."""
+        gens = (self._depth_gen["buy"], self._depth_gen["sell"])
+        if gens == self._last_depth_gen:
+            # nothing inside the band was touched
+            return False
+        self._last_depth_gen = gens
+        # the same cached tick levels the published depth is formatted from
+        key = (self._levels("sell", self.depth_band), self._levels("buy", self.depth_band))
+        if key == self._last_depth_key:
+            return False
+        self._last_depth_key = key
+        return True
+
+    def pop_l2_changes(self) -> List[Dict]:
+        """
+        Level updates since the previous call, as absolute sizes
+        ({"side": "bid"|"ask", "price", "size"}; size "0" means the level is gone).
+        """
+        conv = self.converter
+        changes = []
+        for side, book, label in (("buy", self.bids, "bid"), ("sell", self.asks, "ask")):
+            touched = self._l2_changes[side]
+            for price in sorted(touched):
+                lvl = book.get(price)
+                changes.append({"side": label, "price": conv.price_str(price), "size": conv.qty_str(lvl.total if lvl else 0)})
+            touched.clear()
+        return changes
+
+    def bbo_changed(self) -> bool:
+        """True if best bid/ask price or size differ from the previous call."""
+        key = (self.best_bid(), self.best_ask())
+        if key == self._last_bbo_key:
+            return False
+        self._last_bbo_key = key
+        return True
+
+    def total_traded_qty(self, result: Dict) -> Decimal:
+        """Filled quantity of a submit_order result, summed in ticks and converted once."""
+        return D(self.converter.qty_str(sum(t.qty for t in result["trades"])))
+
+    def _opposite_book(self, side: str) -> Dict[int, PriceLevel]:
+        return self.asks if side == "buy" else self.bids
 
-            MAKER_FEE_RATE = D("-0.0002")  # -0.02% rebate
-            TAKER_FEE_RATE = D("0.0010")   # 0.1% fee
-
-            # helpers
-            def make_trade(price: Decimal, qty: Decimal, maker: Order, taker: Order, aggressor_side: str):
-                self.trade_seq += 1
-                trade_value=price*qty
-                maker_fee = trade_value * MAKER_FEE_RATE
-                taker_fee = trade_value * TAKER_FEE_RATE
-                trade = {
-                    "timestamp": now_iso(),
-                    "symbol": self.symbol,
-                    "trade_id": f"{self.symbol}-{self.trade_seq}-{uuid.uuid4()}",
-                    "price": str(price),
-                    "quantity": str(qty),
-                    "trade_value": str(trade_value),
-                    "aggressor_side": aggressor_side,
-                    "maker_order_id": maker.id,
-                    "taker_order_id": taker.id,
-                    "maker_fee": str(maker_fee),
-                    "taker_fee": str(taker_fee),
-                }
-                return trade
-
-            is_market = order.order_type == "market"
-
-            # ----------------------------
-            # FOK pre-check: ensure fillable at acceptable prices only
-            # ----------------------------
-            if order.order_type == "fok":
-                total = D("0")
-                opp = self._opposite_book(order.side)
-
-                if len(opp) == 0:
-                    logger.info(f"FOK order {order.id} cannot be filled (no liquidity) -> canceled")
-                    return {"order_id": order.id, "status": "canceled", "reason": "fok_not_fillable", "trades": []}
-
-                if is_market:
-                    # market FOK: sum entire opposite book
-                    for p, lvl in opp.items():
-                        total += lvl.total
-                else:
-                    # limit FOK: sum only levels that are acceptable to the taker price
-                    if order.side == "buy":
-                        # accept asks with price <= order.price
-                        for p, lvl in opp.items():
-                            if p > order.price:
-                                break
-                            total += lvl.total
-                    else:
-                        # sell: accept bids with price >= order.price
-                        for p in reversed(opp.keys()):
-                            if p < order.price:
-                                break
-                            total += opp[p].total
-
-                logger.debug(f"FOK pre-check total available={total} for required {order.quantity}")
-                if total < order.quantity:
-                    logger.info(f"FOK order {order.id} cannot be filled fully -> canceled")
-                    return {"order_id": order.id, "status": "canceled", "reason": "fok_not_fillable", "trades": []}
-
-            # ----------------------------
-            # Matching loop (price-time priority)
-            # ----------------------------
-            opp = self._opposite_book(order.side)
-            same = self._same_book(order.side)
-
-            while order.remaining > D("0"):
-                if len(opp) == 0:
-                    # no liquidity
-                    break
-
-                # determine best opposite price & level
-                if order.side == "buy":
-                    # best ask is lowest price
-                    best_price, best_level = opp.peekitem(0)
-                    price_acceptable = True if is_market else (best_price <= order.price)
-                else:
-                    # best bid is highest price (peekitem(-1))
-                    best_price, best_level = opp.peekitem(-1)
-                    price_acceptable = True if is_market else (best_price >= order.price)
-
-                if not price_acceptable:
-                    # best price not acceptable -> cannot match further
-                    break
-
-                # match against resting orders at this price level (FIFO)
-                while order.remaining > D("0") and len(best_level.queue) > 0:
-                    resting = best_level.queue[0]  # oldest resting order at this level
-                    trade_qty = min(order.remaining, resting.remaining)
-                    exec_price = resting.price if resting.price is not None else best_price
-                    trade = make_trade(exec_price, trade_qty, resting, order, aggressor_side=order.side)
-
-                    # update quantities
-                    order.remaining -= trade_qty
-                    resting.remaining -= trade_qty
-                    best_level.total -= trade_qty
+    def _same_book(self, side: str) -> Dict[int, PriceLevel]:
+        return self.bids if side == "buy" else self.asks
 
-                    # if resting fully filled, remove it
-                    if resting.remaining == D("0"):
-                        best_level.queue.popleft()
-                        if resting.id in self.orders:
-                            del self.orders[resting.id]
+    def submit_order(self, order: Order) -> Dict:
+        """
+        Match an order synchronously. Returns dict describing order status and
+        trades list (if any) as Trade objects.
+        """
+        return self._match(order)
 
-                    # record and send trade
+    def submit_orders_sync(self, orders: Iterable[Order]) -> List[Dict]:
+        """
+        Match a batch of orders in sequence. On an OrderBook this bypasses the
+        writer queue, so it is only safe when nothing else can be mutating the
+        book, e.g. seeding a book before it is served, or from inside execute().
+        The cyclic GC is paused for the batch so a collection can't land mid-burst.
+        """
+        match = self._match
+        gc_was_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            return [match(o) for o in orders]
+        finally:
+            if gc_was_enabled:
+                gc.enable()
+
+    def _match(self, order: Order) -> Dict:
+        """
+        Synchronous matching core. It never awaits and only touches ints, dicts and
+        the level lists, so it can be profiled (or swapped for a compiled version)
+        independently of the async wrapper that serializes access to the book.
+        The order type is dispatched once here to a matcher specialized for it.
+        Stops crossed by the resulting trades fire in the same step; their fills
+        are returned under "stop_trades".
+        """
+        # whether debug logging is on is decided once per matching step;
+        # every per-order/per-trade log below only checks this flag
+        self._debug = logger.isEnabledFor(logging.DEBUG)
+        if self._debug:
+            logger.debug("Submitting order %s %s %s %s@%s", order.id, order.side, order.order_type, order.quantity, order.price)
+        result = self._matchers[order.order_type](order)
+        if result["trades"] and self.stop_ids:
+            stop_trades = self._fire_stops(result["trades"])
+            if stop_trades:
+                result["stop_trades"] = stop_trades
+        return result
+
+    def _acceptable_prices(self, side: str, limit_price: Optional[int]):
+        """Opposite-side prices an order on side may trade at, best first; no limit accepts all."""
+        if side == "buy":
+            # asks: lowest price first, up to the limit
+            if limit_price is None:
+                return self.ask_prices
+            return self.ask_prices.irange(maximum=limit_price)
+        # bids: highest price first, down to the limit
+        if limit_price is None:
+            return reversed(self.bid_prices)
+        return self.bid_prices.irange(minimum=limit_price, reverse=True)
+
+    def _sweep(self, order: Order, limit_price: Optional[int]) -> List[Trade]:
+        """
+        Match order against the opposite side (price-time priority) at prices no
+        worse than limit_price. The price rule lives entirely in the level range,
+        so the loop itself has no per-type checks.
+        """
+        side = order.side
+        # non-crossing orders (the common resting case) are decided on the cached
+        # best price alone, without building a level iterator or a timestamp
+        if side == "buy":
+            best = self._best_ask
+            if best is None or (limit_price is not None and best > limit_price):
+                return []
+        else:
+            best = self._best_bid
+            if best is None or (limit_price is not None and best < limit_price):
+                return []
+        # per-trade logs are debug-only and lazily formatted
+        debug = self._debug
+        trades = []
+        # all trades from one submission share the batch timestamp
+        batch_ts = now_iso()
+        opp = self._opposite_book(side)
+        opp_side = "sell" if side == "buy" else "buy"
+        order_nodes = self.order_nodes
+        symbol = self.symbol
+        conv = self.converter
+        taker_id = order.id
+        seq = self.trade_seq
+        # loop-carried quantities live in locals and are written back once:
+        # remaining -> order.remaining at the end, lvl_total -> level.total per level
+        remaining = order.remaining
+        # fully consumed levels are dropped from the sorted price list in one slice once the sweep is done
+        cleared = 0
+
+        for best_price in self._acceptable_prices(side, limit_price):
+            if remaining == 0:
+                break
+            best_level = opp[best_price]
+            self._touch(opp_side, best_price)
+            lvl_total = best_level.total
+
+            if remaining >= lvl_total:
+                # the whole level is taken: every resting order fills completely, so
+                # skip per-order unlinking and size bookkeeping and drop the level at once
+                resting = best_level.head
+                while resting is not None:
+                    exec_price = resting.price if resting.price is not None else best_price
+                    seq += 1
+                    trade = Trade(batch_ts, symbol, seq, exec_price, resting.remaining, resting.id, taker_id, side, conv)
+                    resting.remaining = 0
+                    order_nodes.pop(resting.id, None)
+                    # cut the forward link before recycling so the dropped chain holds no
+                    # reference cycles (create() clears prev when the order is reused)
+                    nxt = resting.next
+                    resting.next = None
+                    resting.release()
+                    resting = nxt
                     trades.append(trade)
-                    logger.info(f"Trade executed: {trade}")
-                    if on_trade_callback:
-                        if asyncio.iscoroutinefunction(on_trade_callback):
-                            await on_trade_callback(trade)
-                        else:
-                            on_trade_callback(trade)
-
-                # if level empty remove price level
-                if len(best_level.queue) == 0:
-                    try:
-                        del opp[best_price]
-                    except Exception:
-                        pass
-
-                # continue while loop to attempt next price level if still remaining
-
-            # ----------------------------
-            # Post-match handling for IOC / FOK / market / limit
-            # ----------------------------
-
-            # IOC: do not rest any remainder; any unfilled portion is canceled
-            if order.order_type == "ioc":
-                if order.remaining > D("0"):
-                    status = "partial" if len(trades) > 0 else "canceled"
-                    logger.info(f"IOC order {order.id} completed with status={status}, remaining canceled")
-                    return {"order_id": order.id, "status": status, "trades": trades}
-                else:
-                    # fully filled
-                    logger.info(f"IOC order {order.id} fully filled")
-                    return {"order_id": order.id, "status": "filled", "trades": trades}
-
-            # FOK: should have been pre-checked; if any remainder exists here it's an unexpected condition.
-            if order.order_type == "fok":
-                if order.remaining > D("0"):
-                    # Defensive: if we somehow couldn't fill after pre-check, rollback (not implemented)
-                    logger.info(f"FOK order {order.id} unexpectedly not fully filled -> cancel (no partial fills permitted)")
-                    # In this implementation we will cancel and return trades (but ideally would rollback trades)
-                    return {"order_id": order.id, "status": "canceled", "trades": []}
-                else:
-                    logger.info(f"FOK order {order.id} fully filled")
-                    return {"order_id": order.id, "status": "filled", "trades": trades}
-
-            # If remaining > 0 and it is limit order -> place remaining on the book
-            if order.remaining > D("0") and order.order_type == "limit":
-                price = order.price
-                level = self._ensure_level(same, price)
-                level.add(order)
-                self.orders[order.id] = order
-                status = "resting" if len(trades) == 0 else "partial"
-                logger.info(f"Limit order {order.id} resting on book {order.side} {order.remaining}@{price}")
-                return {"order_id": order.id, "status": status, "trades": trades}
-
-            # Market orders: any remaining quantity after consuming book is canceled (market cannot rest)
-            if order.remaining > D("0"):
-                status = "partial" if len(trades) > 0 else "canceled"
-                logger.info(f"Market order {order.id} leftover -> status {status}")
-                return {"order_id": order.id, "status": status, "trades": trades}
-
-            # If we reach here, order fully filled
-            logger.info(f"Order {order.id} fully filled")
-            return {"order_id": order.id, "status": "filled", "trades": trades}
+                    if debug:
+                        logger.debug("Trade executed: %s", trade)
+                remaining -= lvl_total
+                best_level.head = best_level.tail = None
+                best_level.total = 0
+                del opp[best_price]
+                cleared += 1
+                continue
+
+            # partial level: match against resting orders at this price level (FIFO)
+            resting = best_level.head  # oldest resting order at this level
+            while remaining > 0 and resting is not None:
+                resting_remaining = resting.remaining
+                trade_qty = remaining if remaining < resting_remaining else resting_remaining
+                exec_price = resting.price if resting.price is not None else best_price
+                seq += 1
+                trade = Trade(batch_ts, symbol, seq, exec_price, trade_qty, resting.id, taker_id, side, conv)
+
+                # update quantities
+                remaining -= trade_qty
+                lvl_total -= trade_qty
+                resting.remaining = resting_remaining - trade_qty
+
+                # if resting fully filled, remove it (unlink subtracts its now-zero remaining)
+                if resting_remaining == trade_qty:
+                    best_level.unlink(resting)
+                    order_nodes.pop(resting.id, None)
+                    resting.release()
+                    resting = best_level.head
+
+                # record trade
+                trades.append(trade)
+                if debug:
+                    logger.debug("Trade executed: %s", trade)
+
+            best_level.total = lvl_total
+            # if level empty remove price level
+            if best_level.head is None:
+                del opp[best_price]
+                cleared += 1
+
+        order.remaining = remaining
+        self.trade_seq = seq
+        if cleared:
+            self._drop_best_levels(opp_side, cleared)
+        return trades
+
+    def _match_limit(self, order: Order) -> Dict:
+        trades = self._sweep(order, order.price)
+        # place any remainder on the book
+        if order.remaining > 0:
+            self.rest_order(order)
+            status = "resting" if len(trades) == 0 else "partial"
+            if self._debug:
+                logger.debug("Limit order %s resting on book %s %s@%s", order.id, order.side, order.remaining, order.price)
+            return {"order_id": order.id, "status": status, "trades": trades}
+        if self._debug:
+            logger.debug("Order %s fully filled", order.id)
+        return {"order_id": order.id, "status": "filled", "trades": trades}
+
+    def _match_market(self, order: Order) -> Dict:
+        trades = self._sweep(order, None)
+        # any remaining quantity after consuming the book is canceled (market cannot rest)
+        if order.remaining > 0:
+            status = "partial" if len(trades) > 0 else "canceled"
+            if self._debug:
+                logger.debug("Market order %s leftover -> status %s", order.id, status)
+            return {"order_id": order.id, "status": status, "trades": trades}
+        if self._debug:
+            logger.debug("Order %s fully filled", order.id)
+        return {"order_id": order.id, "status": "filled", "trades": trades}
+
+    def _match_ioc(self, order: Order) -> Dict:
+        trades = self._sweep(order, order.price)
+        # do not rest any remainder; any unfilled portion is canceled
+        if order.remaining > 0:
+            status = "partial" if len(trades) > 0 else "canceled"
+            if self._debug:
+                logger.debug("IOC order %s completed with status=%s, remaining canceled", order.id, status)
+            return {"order_id": order.id, "status": status, "trades": trades}
+        if self._debug:
+            logger.debug("IOC order %s fully filled", order.id)
+        return {"order_id": order.id, "status": "filled", "trades": trades}
+
+    def _fok_feasible(self, side: str, limit_price: Optional[int], need_qty: int) -> bool:
+        """Read-only check that need_qty can be filled for side at prices no worse than limit_price."""
+        opp = self._opposite_book(side)
+        # sum acceptable levels best-first, stopping as soon as the order is covered
+        total = 0
+        for p in self._acceptable_prices(side, limit_price):
+            total += opp[p].total
+            if total >= need_qty:
+                return True
+        return False
+
+    def _match_fok(self, order: Order) -> Dict:
+        # pre-check without touching the book, so a kill needs no rollback
+        if not self._fok_feasible(order.side, order.price, order.quantity):
+            if self._debug:
+                logger.debug("FOK order %s cannot be filled fully -> canceled", order.id)
+            return {"order_id": order.id, "status": "canceled", "reason": "fok_not_fillable", "trades": []}
+
+        trades = self._sweep(order, order.price)
+        if order.remaining > 0:
+            # Defensive: if we somehow couldn't fill after pre-check, rollback (not implemented)
+            logger.warning("FOK order %s unexpectedly not fully filled -> cancel (no partial fills permitted)", order.id)
+            # In this implementation we will cancel and return trades (but ideally would rollback trades)
+            return {"order_id": order.id, "status": "canceled", "trades": []}
+        if self._debug:
+            logger.debug("FOK order %s fully filled", order.id)
+        return {"order_id": order.id, "status": "filled", "trades": trades}
+
+    def _place_stop(self, order: Order) -> Dict:
+        # nothing matches yet; the stop waits in its ladder for a trade to cross the trigger
+        self.add_stop(order)
+        if self._debug:
+            logger.debug("Stop order %s placed %s trigger@%s", order.id, order.side, order.price)
+        return {"order_id": order.id, "status": "stop_placed", "trades": []}
+
+
+class OrderBook(SyncOrderBook):
+    """SyncOrderBook behind a single-writer queue, for concurrent async callers."""
+
+    def __init__(self, symbol: str, depth_band: int = 10):
+        super().__init__(symbol, depth_band)
+        # single-writer dispatch: every mutation is queued and applied by one worker task
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+        self._worker_loop: Optional[asyncio.AbstractEventLoop] = None
+
+    async def execute(self, fn: Callable[..., Any], *args) -> Any:
+        """
+        Run fn(*args) against this book on its single writer, after everything
+        already queued. fn must be synchronous; the worker never awaits mid-mutation.
+        """
+        loop = asyncio.get_running_loop()
+        if self._worker_loop is not loop or self._worker.done():
+            self._queue = asyncio.Queue()
+            self._worker = loop.create_task(self._run_worker())
+            self._worker_loop = loop
+        fut = loop.create_future()
+        self._queue.put_nowait((fn, args, fut))
+        return await fut
+
+    async def _run_worker(self):
+        queue = self._queue
+        while True:
+            fn, args, fut = await queue.get()
+            try:
+                result = fn(*args)
+            except Exception as e:
+                if not fut.cancelled():
+                    fut.set_exception(e)
+            else:
+                if not fut.cancelled():
+                    fut.set_result(result)
+
+    async def submit_order(self, order: Order) -> Dict:
+        """
+        Submit an order. Returns dict describing order status and trades list (if any).
+        Trades are only collected here as Trade objects; the caller formats and
+        broadcasts them as one batch after matching.
+        """
+        return await self.execute(self._match, order)
 
+    async def submit_orders(self, orders: Iterable[Order]) -> List[Dict]:
+        """Submit a batch of orders in one trip through the writer queue; results are in order."""
+        return await self.execute(self.submit_orders_sync, list(orders))
@@ -1,13 +1,13 @@
-
-from typing import Dict, List
-from core.order import D, Order
-from core.orderbook import OrderBook
 import asyncio
+from typing import Dict, List, Optional, Set
+from core.order import Order
+from core.orderbook import OrderBook, Trade
 from core.manager import manager
 
 
 books: Dict[str, OrderBook] = {}
-stop_orders: Dict[str, List[Order]] = {}
+# match-and-publish tasks still running; the loop only holds weak references to tasks
+_in_flight: Set[asyncio.Task] = set()
 
 
 
@@ -18,30 +18,55 @@ def get_or_create_book(symbol: str) -> OrderBook:
     return books[symbol]
 
 
-# callback for trades to broadcast
-async def on_trade_callback(trade: dict):
-    book = books.get(trade["symbol"])
-    if book:
-        # send to trade subscribers
-        await manager.broadcast_trade(trade["symbol"], trade)
-        # also send updated market snapshot
-        snapshot = book.get_depth(10)
-        await manager.broadcast_market(trade["symbol"], snapshot)
-
-
-        triggered_orders = []
-        if trade["symbol"] in stop_orders:
-            for stop_order in list(stop_orders[trade["symbol"]]):
-                trigger_price = stop_order.price
-                trade_price = D(trade["price"])
-                # Buy stop triggers if trade price >= stop price
-                # Sell stop triggers if trade price <= stop price
-                if (stop_order.side == "buy" and trade_price >= trigger_price) or \
-                   (stop_order.side == "sell" and trade_price <= trigger_price):
-                    triggered_orders.append(stop_order)
-
-            for o in triggered_orders:
-                stop_orders[trade["symbol"]].remove(o)
-                o.order_type = "market"
-                book = get_or_create_book(o.symbol)
-                asyncio.create_task(book.submit_order(o, on_trade_callback=on_trade_callback))
+async def process_order(book: OrderBook, order: Order) -> Dict:
+    """Match an order, then publish its trades (and those of any stops it fired) and the resulting book once."""
+    # once queued the order will match, so a cancelled caller (e.g. a dropped
+    # client) must not skip publishing its fills: the pair runs as its own task
+    task = asyncio.get_running_loop().create_task(_match_and_publish(book, order))
+    _in_flight.add(task)
+    task.add_done_callback(_in_flight.discard)
+    return await asyncio.shield(task)
+
+
+async def _match_and_publish(book: OrderBook, order: Order) -> Dict:
+    result = await book.submit_order(order)
+    trades = result["trades"]
+    payload = await publish_trades(book, trades + result.pop("stop_trades", []))
+    # the caller only gets the fills of its own order
+    result["trades"] = payload[:len(trades)]
+    return result
+
+
+def add_stop_order(order: Order):
+    # direct call; only safe outside the book's writer (e.g. seeding), routes go through book.execute
+    get_or_create_book(order.symbol).add_stop(order)
+
+
+def get_stop_orders(symbol: str) -> List[Order]:
+    book = books.get(symbol)
+    return book.get_stops() if book is not None else []
+
+
+async def publish_book(book: OrderBook, ts: Optional[str] = None):
+    """Broadcast L2 deltas, and depth / BBO only when they changed since last published."""
+    changes = book.pop_l2_changes()
+    if changes:
+        await manager.broadcast_l2(book.symbol, changes)
+    if book.depth_changed():
+        await manager.broadcast_market(book.symbol, book.get_depth(book.depth_band, ts=ts))
+    if book.bbo_changed():
+        await manager.broadcast_bbo(book.symbol, book.get_bbo(ts=ts))
+
+
+# broadcast the outcome of one match as a single batch
+async def publish_trades(book: OrderBook, trades: List[Trade]) -> List[dict]:
+    """Broadcast a batch of trades and the book they left, and return the formatted trades."""
+    symbol = book.symbol
+    # trades are formatted once here, for subscribers and the REST response alike
+    payload = [t.to_dict() for t in trades]
+    # send to trade subscribers
+    if payload:
+        await manager.broadcast_trades(symbol, payload)
+    # also send updated market snapshot
+    await publish_book(book, ts=trades[0].timestamp if trades else None)
+    return payload
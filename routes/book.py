@@ -1,8 +1,8 @@
 from fastapi import APIRouter, HTTPException
-from core.order import Order, OrderSubmission, D
+from core.order import Order, OrderSubmission
 from core.orderbook import OrderBook
 from core.manager import manager
-from core.storage import books, stop_orders, get_or_create_book, on_trade_callback
+from core.storage import books, get_stop_orders, get_or_create_book, publish_trades
 from utils.logger import logger
 
 
@@ -14,13 +14,14 @@ router = APIRouter()
 async def get_book(symbol: str, depth: int = 10):
     book = get_or_create_book(symbol)
     depth_data=book.get_depth(depth)
-    stops = stop_orders.get(symbol, [])
+    conv = book.converter
+    stops = get_stop_orders(symbol)
     stop_data = [
         {
             "order_id": o.id,
             "side": o.side,
-            "quantity": str(o.remaining),
-            "trigger_price": str(o.price),
+            "quantity": conv.qty_str(o.remaining),
+            "trigger_price": conv.price_str(o.price),
             "order_type": o.order_type
         }
         for o in stops
@@ -49,18 +50,21 @@ async def demo_fill(symbol: str, bids: int = 5, asks: int = 5):
     Create some demo resting limit orders (useful for manual testing)
     """
     book = get_or_create_book(symbol)
+    conv = book.converter
     # create bids descending
-    mid = D("30000")
-    spread = D("50")
+    mid = conv.price_to_ticks("30000")
+    spread = conv.price_to_ticks("50")
+    step = conv.price_to_ticks("10")
+    qty = conv.qty_to_ticks("0.1")
+    orders = []
     for i in range(bids):
-        p = mid - (i + 1) * D("10")
-        o = Order.create(symbol, "sell" if False else "buy", "limit", D("0.1"), p)
-        await book.submit_order(o, on_trade_callback=on_trade_callback)
+        p = mid - (i + 1) * step
+        orders.append(Order.create(symbol, "buy", "limit", qty, p))
     for i in range(asks):
-        p = mid + (i + 1) * D("10")
-        o = Order.create(symbol, "sell", "limit", D("0.1"), p)
-        await book.submit_order(o, on_trade_callback=on_trade_callback)
-    snapshot = book.get_depth(10)
-    await manager.broadcast_market(symbol, snapshot)
+        p = mid + (i + 1) * step
+        orders.append(Order.create(symbol, "sell", "limit", qty, p))
+    # one queue trip for the whole batch
+    results = await book.submit_orders(orders)
+    await publish_trades(book, [t for res in results for t in res["trades"] + res.get("stop_trades", [])])
     return {"status": "ok", "bbo": book.get_bbo()}
 
@@ -1,67 +1,45 @@
 from fastapi import APIRouter, HTTPException, WebSocket, WebSocketDisconnect
-from core.order import Order, OrderSubmission, D
+from core.order import Order, OrderModification, OrderSubmission
 from core.orderbook import OrderBook
 from core.manager import manager
-from core.storage import books, stop_orders, get_or_create_book, on_trade_callback
+from core.storage import books, get_or_create_book, process_order, publish_book
 from utils.logger import logger
-from pydantic import BaseModel
 from typing import Optional
 
 
 router = APIRouter()
 
+def _modified_ticks(modify, order_id: str, quantity: Optional[int], price: Optional[int]):
+    """
+    Run a modify on the book's writer and copy out (price, remaining) ticks there,
+    so the handler never reads the order after the await: it may be filled and recycled by then.
+    """
+    order = modify(order_id, quantity, price)
+    return None if order is None else (order.price, order.remaining)
+
 @router.post("/orders")
 async def submit_order(payload: OrderSubmission):
-    # validate & create Order
-    print("order received")
+    # payload is already validated and converted to integer ticks
     symbol = payload.symbol
-    order_type = payload.order_type.lower()
-    side = payload.side.lower()
-    # quantity and price as Decimal
-    try:
-        qty = D(payload.quantity)
-        if qty <= D("0"):
-            raise ValueError("quantity must be positive")
-    except Exception as e:
-        raise HTTPException(status_code=400, detail=f"Invalid quantity: {e}")
-
-    price = None
-    if payload.price is not None:
-        try:
-            price = D(payload.price)
-            if price <= D("0"):
-                raise ValueError("price must be positive")
-        except Exception as e:
-            raise HTTPException(status_code=400, detail=f"Invalid price: {e}")
-    
+    order_type = payload.order_type
+    side = payload.side
+    qty = payload.quantity_ticks
+    price = payload.price_ticks
+
+    book = get_or_create_book(symbol)
     if order_type == "stoploss":
-            if price is None:
-                raise HTTPException(status_code=400, detail="Stop-loss orders require a trigger price")
             order = Order.create(symbol=symbol, side=side, order_type=order_type, quantity=qty, price=price)
-            stop_orders.setdefault(symbol, []).append(order)
-            return {"order_id": order.id, "status": "stop_placed", "trigger_price": str(price)}
-    
-
-    if order_type == "limit" and price is None:
-        raise HTTPException(status_code=400, detail="Limit orders require a price")
-    
-    if order_type == "ioc" and price is None:
-        raise HTTPException(status_code=400, detail="ioc orders require a price, as its a limit ioc")
-
-    if order_type == "fok" and price is None:
-        raise HTTPException(status_code=400, detail="fok orders require a price, as its a limit fok")
+            # parked in the book's stop ladder; fired by the matching step whose trades cross it
+            await book.execute(book.add_stop, order)
+            return {"order_id": order.id, "status": "stop_placed", "trigger_price": book.converter.price_str(price)}
 
     order = Order.create(symbol=symbol, side=side, order_type=order_type, quantity=qty, price=price)
-    book = get_or_create_book(symbol)
 
-    # process
-    result = await book.submit_order(order, on_trade_callback=on_trade_callback)
+    # process; trades and BBO/depth are broadcast even if no trades (e.g., resting order)
+    result = await process_order(book, order)
 
-    # broadcast BBO/depth even if no trades (e.g., resting order)
-    snapshot = book.get_depth(10)
-    await manager.broadcast_market(symbol, snapshot)
-
-    return {"order_id": order.id, "status": result["status"], "trades": result["trades"]}
+    # read the id from the result: once resting, the order may be filled and recycled meanwhile
+    return {"order_id": result["order_id"], "status": result["status"], "trades": result["trades"]}
 
 
 
@@ -69,112 +47,73 @@ async def submit_order(payload: OrderSubmission):
 async def cancel_order(order_id: str):
     # find order in all books
     for book in books.values():
-        order = book.orders.get(order_id)
-        if order:
-            async with book.lock:
-                # remove from price level
-                container = book._same_book(order.side)
-                level = container.get(order.price)
-                if level:
-                    # remove specific order from level queue
-                    for idx, o in enumerate(level.queue):
-                        if o.id == order_id:
-                            level.total -= o.remaining
-                            level.queue.remove(o)
-                            break
-                    book._remove_price_if_empty(container, order.price)
-                # remove from global map
-                del book.orders[order_id]
-
-                # broadcast updated book
-                snapshot = book.get_depth(10)
-                await manager.broadcast_market(order.symbol, snapshot)
-                return {"order_id": order_id, "status": "canceled"}
+        if order_id in book.order_nodes:
+            # O(1) unlink from its price level via the order index, in order with queued submissions
+            order = await book.execute(book.cancel_order, order_id)
+            if order is None:
+                break
+
+            # off the book and no longer referenced by anything, so it can be recycled
+            order.release()
+            # broadcast updated book
+            await publish_book(book)
+            return {"order_id": order_id, "status": "canceled"}
     raise HTTPException(status_code=404, detail="Order not found")
 
 @router.delete("/stoporder/{order_id}")
 async def cancel_stop_order(order_id: str):
-    found = False
-    for symbol, orders in stop_orders.items():
-        for o in list(orders):  # iterate over a copy to safely remove
-            if o.id == order_id:
-                orders.remove(o)
-                found = True
-                logger.info(f"Stop-loss order {order_id} canceled")
+    for book in books.values():
+        if order_id in book.stop_ids:
+            if await book.execute(book.cancel_stop, order_id) is None:
                 break
-        if found:
-            break
-
-    if not found:
-        raise HTTPException(status_code=404, detail="Stop-loss order not found")
-
-    return {"order_id": order_id, "status": "canceled"}
+            logger.info(f"Stop-loss order {order_id} canceled")
+            return {"order_id": order_id, "status": "canceled"}
+    raise HTTPException(status_code=404, detail="Stop-loss order not found")
 
 
-class ModifyOrder(BaseModel):
-    quantity: Optional[str] = None
-    price: Optional[str] = None
+def _modify_ticks(payload: OrderModification, conv):
+    # the payload carries no symbol, so it is converted here with the owning book's scales
+    try:
+        return payload.to_ticks(conv)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
 
 @router.put("/orders/{order_id}")
-async def modify_order(order_id: str, payload: ModifyOrder):
+async def modify_order(order_id: str, payload: OrderModification):
     for book in books.values():
-        order = book.orders.get(order_id)
-        if order:
-            async with book.lock:
-                # remove old order
-                container = book._same_book(order.side)
-                level = container.get(order.price)
-                if level:
-                    for idx, o in enumerate(level.queue):
-                        if o.id == order_id:
-                            level.total -= o.remaining
-                            level.queue.remove(o)
-                            break
-                    book._remove_price_if_empty(container, order.price)
-                # update fields
-                if payload.quantity:
-                    order.quantity = D(payload.quantity)
-                    order.remaining = D(payload.quantity)
-                if payload.price:
-                    order.price = D(payload.price)
-                # reinsert as a new resting order
-                level = book._ensure_level(container, order.price)
-                level.add(order)
-                book.orders[order_id] = order
-
-                # broadcast updated book
-                snapshot = book.get_depth(10)
-                await manager.broadcast_market(order.symbol, snapshot)
-                return {"order_id": order_id, "status": "modified", "new_price": str(order.price), "new_quantity": str(order.remaining)}
-    raise HTTPException(status_code=404, detail="Order not found")
+        if order_id in book.order_nodes:
+            conv = book.converter
+            quantity, price = _modify_ticks(payload, conv)
+            # remove old order and reinsert it as a new resting order
+            ticks = await book.execute(_modified_ticks, book.modify_order, order_id, quantity, price)
+            if ticks is None:
+                break
 
-class ModifyStopOrder(BaseModel):
-    quantity: Optional[str] = None
-    price: Optional[str] = None  # the trigger price
+            new_price, new_remaining = ticks
+            # broadcast updated book
+            await publish_book(book)
+            return {"order_id": order_id, "status": "modified", "new_price": conv.price_str(new_price), "new_quantity": conv.qty_str(new_remaining)}
+    raise HTTPException(status_code=404, detail="Order not found")
 
 @router.put("/stoporder/{order_id}")
-async def modify_stop_order(order_id: str, payload: ModifyStopOrder):
-    found = False
-    for symbol, orders in stop_orders.items():
-        for o in orders:
-            if o.id == order_id:
-                # update fields
-                if payload.quantity:
-                    o.quantity = D(payload.quantity)
-                    o.remaining = D(payload.quantity)
-                if payload.price:
-                    o.price = D(payload.price)
-                found = True
-                logger.info(f"Stop-loss order {order_id} modified")
-                return {
-                    "order_id": o.id,
-                    "status": "modified",
-                    "new_trigger_price": str(o.price),
-                    "new_quantity": str(o.remaining)
-                }
-
-    if not found:
-        raise HTTPException(status_code=404, detail="Stop-loss order not found")
+async def modify_stop_order(order_id: str, payload: OrderModification):
+    # payload.price is the new trigger price
+    for book in books.values():
+        if order_id in book.stop_ids:
+            conv = book.converter
+            quantity, price = _modify_ticks(payload, conv)
+            ticks = await book.execute(_modified_ticks, book.modify_stop, order_id, quantity, price)
+            if ticks is None:
+                break
+            new_trigger, new_remaining = ticks
+            logger.info(f"Stop-loss order {order_id} modified")
+            return {
+                "order_id": order_id,
+                "status": "modified",
+                "new_trigger_price": conv.price_str(new_trigger),
+                "new_quantity": conv.qty_str(new_remaining)
+            }
+    raise HTTPException(status_code=404, detail="Stop-loss order not found")
 
 
 
@@ -200,3 +139,27 @@ async def ws_trades(websocket: WebSocket, symbol: str):
             await websocket.receive_text()
     except WebSocketDisconnect:
         manager.disconnect(websocket)
+
+
+@router.websocket("/ws/bbo/{symbol}")
+async def ws_bbo(websocket: WebSocket, symbol: str):
+    # only sent when best bid/ask price or size changes
+    await manager.connect_bbo(symbol, websocket)
+    try:
+        while True:
+            await websocket.receive_text()
+    except WebSocketDisconnect:
+        manager.disconnect(websocket)
+
+
+@router.websocket("/ws/l2/{symbol}")
+async def ws_l2(websocket: WebSocket, symbol: str):
+    # full book snapshot on connect, then l2_delta messages with absolute level sizes
+    book = get_or_create_book(symbol)
+    # built by connect_l2 once the socket is registered, so no delta falls in between
+    await manager.connect_l2(symbol, websocket, lambda: book.get_depth(max(len(book.ask_prices), len(book.bid_prices))))
+    try:
+        while True:
+            await websocket.receive_text()
+    except WebSocketDisconnect:
+        manager.disconnect(websocket)
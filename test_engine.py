@@ -1,19 +1,23 @@
 import asyncio
 from decimal import Decimal
 import pytest
+from pydantic import ValidationError
 
-from core.orderbook import OrderBook
-from core.order import Order, D
+from core.orderbook import OrderBook, SyncOrderBook
+from core.order import PRICE_REQUIRED, Order, OrderModification, OrderSubmission, get_converter
+from core.manager import manager
+from core.storage import add_stop_order, get_or_create_book, get_stop_orders, process_order
 
 
 def make_order(symbol, side, otype, qty, price=None):
     """Helper to create any type of order."""
+    conv = get_converter(symbol)
     return Order.create(
         symbol=symbol,
         side=side,
         order_type=otype,
-        quantity=D(qty),
-        price=(D(price) if price else None),
+        quantity=conv.qty_to_ticks(qty),
+        price=(conv.price_to_ticks(price) if otype in PRICE_REQUIRED else None),
     )
 
 
@@ -41,14 +45,50 @@ async def test_market_order_fill():
     """Test that market orders consume best available liquidity."""
     book = OrderBook("MKT-USD")
 
-    await book.submit_order(make_order("MKT-USD", "sell", "limit", "1", "100"))
-    await book.submit_order(make_order("MKT-USD", "sell", "limit", "1", "101"))
+    book.submit_orders_sync([
+        make_order("MKT-USD", "sell", "limit", "1", "100"),
+        make_order("MKT-USD", "sell", "limit", "1", "101"),
+    ])
 
     taker = make_order("MKT-USD", "buy", "market", "1.5")
     res = await book.submit_order(taker)
 
     assert res["status"] in ("filled", "partial")
-    assert sum(Decimal(t["quantity"]) for t in res["trades"]) == Decimal("1.5")
+    assert book.total_traded_qty(res) == Decimal("1.5")
+
+
+def test_sync_book_matches_without_event_loop():
+    """Test the synchronous book matches directly, with no asyncio involved."""
+    book = SyncOrderBook("SYN-USD")
+    assert book.submit_order(make_order("SYN-USD", "sell", "limit", "1", "100"))["status"] == "resting"
+
+    res = book.submit_order(make_order("SYN-USD", "buy", "limit", "2", "100"))
+    assert res["status"] == "partial"
+    assert book.total_traded_qty(res) == Decimal("1")
+    assert book.get_depth()["bids"] == [["100", "1"]]
+    # item access formats single fields the same way as the published dict
+    trade = res["trades"][0]
+    assert {k: trade[k] for k in trade.to_dict()} == trade.to_dict()
+    with pytest.raises(KeyError):
+        trade["fee"]
+
+
+def test_sync_book_places_and_fires_submitted_stop():
+    """Test a stoploss submitted like any other order is parked, then fired by a crossing trade."""
+    book = SyncOrderBook("SST-USD")
+    stop = make_order("SST-USD", "buy", "stoploss", "1", "101")
+    assert book.submit_order(stop) == {"order_id": stop.id, "status": "stop_placed", "trades": []}
+    assert book.get_stops() == [stop]
+
+    book.submit_orders_sync([
+        make_order("SST-USD", "sell", "limit", "1", "101"),
+        make_order("SST-USD", "sell", "limit", "1", "102"),
+    ])
+    res = book.submit_order(make_order("SST-USD", "buy", "limit", "1", "101"))
+
+    assert res["status"] == "filled"
+    assert book.get_stops() == []
+    assert [t["price"] for t in res["stop_trades"]] == ["102"]
 
 
 @pytest.mark.asyncio
@@ -88,8 +128,10 @@ async def test_fok_behavior_fillable():
     """Test Fill-Or-Kill (FOK) order fills completely if possible."""
     book = OrderBook("FOK2-USD")
 
-    await book.submit_order(make_order("FOK2-USD", "sell", "limit", "1", "100"))
-    await book.submit_order(make_order("FOK2-USD", "sell", "limit", "1", "101"))
+    await book.submit_orders([
+        make_order("FOK2-USD", "sell", "limit", "1", "100"),
+        make_order("FOK2-USD", "sell", "limit", "1", "101"),
+    ])
 
     fok = make_order("FOK2-USD", "buy", "fok", "2", "102")
     res = await book.submit_order(fok)
@@ -114,7 +156,7 @@ async def test_stoploss_trigger_simulation():
     assert len(pending_stop_orders) == 1
 
     # Simulate price reaching 101
-    last_traded_price = Decimal("101")
+    last_traded_price = get_converter("STOP-USD").price_to_ticks("101")
     if last_traded_price >= stop_order.price:
         # Convert stoploss → market order
         stop_order.order_type = "market"
@@ -124,3 +166,285 @@ async def test_stoploss_trigger_simulation():
 
     assert res["status"] in ("filled", "partial")
     assert any(t["quantity"] for t in res["trades"])
+
+
+@pytest.mark.asyncio
+async def test_best_price_follows_level_changes():
+    """Test cached best bid/ask moves as levels are added and consumed."""
+    book = OrderBook("BBO-USD")
+
+    await book.submit_order(make_order("BBO-USD", "sell", "limit", "1", "105"))
+    await book.submit_order(make_order("BBO-USD", "sell", "limit", "1", "103"))
+    await book.submit_order(make_order("BBO-USD", "buy", "limit", "1", "99"))
+    await book.submit_order(make_order("BBO-USD", "buy", "limit", "1", "100"))
+
+    bbo = book.get_bbo()
+    assert bbo["best_ask"] == ("103", "1")
+    assert bbo["best_bid"] == ("100", "1")
+    conv = book.converter
+    assert book.best_ask() == (conv.price_to_ticks("103"), conv.qty_to_ticks("1"))
+    assert OrderBook("EMPTY-USD").best_bid() is None
+
+    # consume the best ask level entirely
+    await book.submit_order(make_order("BBO-USD", "buy", "market", "1"))
+    assert book.get_bbo()["best_ask"] == ("105", "1")
+
+    depth = book.get_depth(1)
+    assert depth["asks"] == [["105", "1"]]
+    assert depth["bids"] == [["100", "1"]]
+
+
+@pytest.mark.asyncio
+async def test_cancel_resting_order():
+    """Test canceling an order from the middle of a level keeps FIFO and totals intact."""
+    book = OrderBook("CXL-USD")
+
+    o1 = make_order("CXL-USD", "sell", "limit", "1", "100")
+    o2 = make_order("CXL-USD", "sell", "limit", "2", "100")
+    o3 = make_order("CXL-USD", "sell", "limit", "3", "100")
+    for o in (o1, o2, o3):
+        await book.submit_order(o)
+
+    assert book.cancel_order(o2.id) is o2
+    assert book.cancel_order(o2.id) is None
+    assert book.get_depth()["asks"] == [["100", "4"]]
+
+    res = await book.submit_order(make_order("CXL-USD", "buy", "market", "4"))
+    assert [t["maker_order_id"] for t in res["trades"]] == [o1.id, o3.id]
+    assert book.get_depth()["asks"] == []
+    assert book.order_nodes == {}
+
+
+def test_cancel_at_level_ends_and_ioc_never_rests():
+    """Test cancels at the head/tail of a level and of a whole best level; IOC remainders are never indexed."""
+    book = SyncOrderBook("CX2-USD")
+    head, mid, tail = (make_order("CX2-USD", "buy", "limit", "1", "100") for _ in range(3))
+    best = make_order("CX2-USD", "buy", "limit", "1", "101")
+    book.submit_orders_sync([head, mid, tail, best])
+
+    assert book.cancel_order(head.id) is head
+    assert book.cancel_order(tail.id) is tail
+    assert book.cancel_order(best.id) is best
+    assert book.get_bbo()["best_bid"] == ("100", "1")
+    assert list(book.order_nodes) == [mid.id]
+
+    ioc = make_order("CX2-USD", "sell", "ioc", "3", "100")
+    assert book.submit_order(ioc)["status"] == "partial"
+    assert book.order_nodes == {}
+    assert book.get_depth()["asks"] == []
+
+
+@pytest.mark.asyncio
+async def test_sweep_across_levels():
+    """Test a sell sweeping several bid levels best-first and leaving the rest intact."""
+    book = OrderBook("SWP-USD")
+
+    for price in ("97", "98", "99", "100"):
+        await book.submit_order(make_order("SWP-USD", "buy", "limit", "1", price))
+
+    res = await book.submit_order(make_order("SWP-USD", "sell", "limit", "2.5", "98"))
+
+    assert res["status"] == "filled"
+    assert [t["price"] for t in res["trades"]] == ["100", "99", "98"]
+    assert book.get_depth()["bids"] == [["98", "0.5"], ["97", "1"]]
+    assert book.get_bbo()["best_bid"] == ("98", "0.5")
+
+    conv = book.converter
+    snapshot = book.depth_snapshot()
+    assert snapshot["bids"] == ((conv.price_to_ticks("98"), conv.qty_to_ticks("0.5")), (conv.price_to_ticks("97"), conv.qty_to_ticks("1")))
+    assert snapshot["asks"] == ()
+    # unchanged band is served from the cache
+    assert book.depth_snapshot()["bids"] is snapshot["bids"]
+
+
+@pytest.mark.asyncio
+async def test_trades_are_formatted_on_publish():
+    """Test trades keep raw ticks until they are formatted for the wire."""
+    conv = get_converter("FMT-USD")
+    book = get_or_create_book("FMT-USD")
+    await book.submit_order(make_order("FMT-USD", "sell", "limit", "0.5", "100"))
+
+    res = await book.submit_order(make_order("FMT-USD", "buy", "market", "0.5"))
+    trade = res["trades"][0]
+    assert trade.price == conv.price_to_ticks("100")
+    assert trade.qty == conv.qty_to_ticks("0.5")
+
+    await book.submit_order(make_order("FMT-USD", "sell", "limit", "0.5", "100"))
+    res = await process_order(book, make_order("FMT-USD", "buy", "market", "0.5"))
+    assert res["trades"][0]["price"] == "100"
+    assert res["trades"][0]["trade_value"] == "50"
+    assert res["trades"][0]["taker_fee"] == "0.05"
+
+
+def test_order_submission_converts_to_ticks():
+    """Test the REST payload validates and converts quantity/price to ticks."""
+    conv = get_converter("VAL-USD")
+    sub = OrderSubmission(symbol=" VAL-USD ", order_type="limit", side="buy", quantity="0.5", price="100.25")
+    assert sub.symbol == "VAL-USD"
+    assert sub.quantity_ticks == conv.qty_to_ticks("0.5")
+    assert sub.price_ticks == conv.price_to_ticks("100.25")
+
+    market = OrderSubmission(symbol="VAL-USD", order_type="market", side="sell", quantity="1", price="99")
+    assert market.price_ticks is None
+
+    for bad in (
+        dict(order_type="limit", quantity="1"),  # limit needs a price
+        dict(order_type="market", quantity="0"),
+        dict(order_type="market", quantity="abc"),
+        dict(order_type="limit", quantity="1", price="-1"),
+    ):
+        with pytest.raises(ValidationError):
+            OrderSubmission(symbol="VAL-USD", side="buy", **bad)
+
+
+def test_order_modification_validates_like_submission():
+    """Test modify payloads convert to ticks and reject bad or non-positive values."""
+    conv = get_converter("VAL-USD")
+    assert OrderModification(price=" 100.25 ").to_ticks(conv) == (None, conv.price_to_ticks("100.25"))
+    assert OrderModification(quantity="2").to_ticks(conv) == (conv.qty_to_ticks("2"), None)
+    for bad in ({"quantity": "abc"}, {"quantity": "0"}, {"quantity": "-1"}, {"price": "0.000000001"}):
+        with pytest.raises(ValueError):
+            OrderModification(**bad).to_ticks(conv)
+
+
+def test_tick_conversion_is_exact():
+    """Test decimal strings convert to int64 ticks exactly, beyond Decimal context precision."""
+    conv = get_converter("BIG-USD")
+    assert conv.price_to_ticks("92233720368.54775807") == 2 ** 63 - 1
+    assert conv.price_str(2 ** 63 - 1) == "92233720368.54775807"
+    assert conv.price_to_ticks("-92233720368.54775808") == -2 ** 63
+    assert conv.qty_to_ticks("1E+2") == 100 * 10 ** 8
+    assert conv.qty_to_ticks("0e999999999") == 0
+    # out of int64 range, over-precise or non-finite; huge exponents are rejected without expanding them
+    for bad in ("92233720368.54775808", "1e50000000", "1e-50000000", "0.000000001", "nan", "inf", "1" * 100_000):
+        with pytest.raises(ValueError):
+            conv.qty_to_ticks(bad)
+
+
+@pytest.mark.asyncio
+async def test_stop_ladder_triggers_crossed_stops():
+    """Test only stops whose trigger was crossed by the trade batch are fired."""
+    symbol = "LAD-USD"
+    book = get_or_create_book(symbol)
+
+    for price in ("100", "101", "102", "103"):
+        await book.submit_order(make_order(symbol, "sell", "limit", "1", price))
+    await book.submit_order(make_order(symbol, "buy", "limit", "5", "90"))
+
+    fired = make_order(symbol, "buy", "stoploss", "1", "101")
+    pending = make_order(symbol, "buy", "stoploss", "1", "105")
+    sell_stop = make_order(symbol, "sell", "stoploss", "1", "95")
+    for o in (pending, sell_stop, fired):
+        add_stop_order(o)
+
+    # trades at 100 and 101 cross the 101 buy stop only
+    res = await process_order(book, make_order(symbol, "buy", "market", "2"))
+
+    assert fired.order_type == "market"
+    assert fired.remaining == 0
+    assert get_stop_orders(symbol) == [pending, sell_stop]
+    assert fired.id not in book.stop_ids
+    # the caller only sees its own fills; the stop's fill at 102 is published separately
+    assert [t["price"] for t in res["trades"]] == ["100", "101"]
+    assert "stop_trades" not in res
+    assert book.get_bbo()["best_ask"] == ("103", "1")
+
+
+@pytest.mark.asyncio
+async def test_cancelled_caller_still_publishes_fills(monkeypatch):
+    """Test fills are broadcast even if the submitting coroutine is cancelled mid-flight."""
+    published = []
+
+    async def record(symbol, trades):
+        published.append(trades)
+
+    monkeypatch.setattr(manager, "broadcast_trades", record)
+    book = get_or_create_book("CXL-USD")
+    await book.submit_order(make_order("CXL-USD", "sell", "limit", "1", "100"))
+
+    task = asyncio.create_task(process_order(book, make_order("CXL-USD", "buy", "market", "1")))
+    await asyncio.sleep(0)
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+    for _ in range(10):
+        if published:
+            break
+        await asyncio.sleep(0)
+
+    assert book.trade_seq == 1
+    assert [t["price"] for t in published[0]] == ["100"]
+    assert book.get_bbo()["best_ask"] is None
+
+
+@pytest.mark.asyncio
+async def test_concurrent_submissions_are_serialized():
+    """Test concurrently submitted orders are matched one at a time in arrival order."""
+    book = OrderBook("SEQ-USD")
+    await book.submit_order(make_order("SEQ-USD", "sell", "limit", "3", "100"))
+
+    buys = [make_order("SEQ-USD", "buy", "limit", "1", "100") for _ in range(4)]
+    results = await asyncio.gather(*(book.submit_order(o) for o in buys))
+
+    assert [r["status"] for r in results] == ["filled", "filled", "filled", "resting"]
+    assert book.get_bbo()["best_bid"] == ("100", "1")
+    assert book.get_bbo()["best_ask"] is None
+
+    # cancels queue behind pending submissions
+    cancel = await book.execute(book.cancel_order, buys[3].id)
+    assert cancel is buys[3]
+
+
+@pytest.mark.asyncio
+async def test_depth_change_detection():
+    """Test depth/BBO change flags ignore updates outside the published levels."""
+    book = OrderBook("CHG-USD", depth_band=1)
+    await book.submit_order(make_order("CHG-USD", "sell", "limit", "1", "100"))
+    await book.submit_order(make_order("CHG-USD", "sell", "limit", "1", "101"))
+
+    assert book.depth_changed() and book.bbo_changed()
+    assert not book.depth_changed() and not book.bbo_changed()
+
+    # an order behind the top level changes neither view
+    await book.submit_order(make_order("CHG-USD", "sell", "limit", "1", "101"))
+    assert not book.depth_changed() and not book.bbo_changed()
+    assert book.get_depth(1)["asks"] == [["100", "1"]]
+
+    # adding size at the best price changes both
+    await book.submit_order(make_order("CHG-USD", "sell", "limit", "1", "100"))
+    assert book.depth_changed() and book.bbo_changed()
+    assert book.get_depth(1)["asks"] == [["100", "2"]]
+
+
+
+@pytest.mark.asyncio
+async def test_l2_changes_report_absolute_sizes():
+    """Test level deltas carry the new size of every touched level, 0 when removed."""
+    book = OrderBook("L2-USD")
+    await book.submit_order(make_order("L2-USD", "sell", "limit", "1", "100"))
+    await book.submit_order(make_order("L2-USD", "sell", "limit", "2", "101"))
+    book.pop_l2_changes()
+
+    await book.submit_order(make_order("L2-USD", "buy", "limit", "1.5", "101"))
+
+    assert book.pop_l2_changes() == [
+        {"side": "ask", "price": "100", "size": "0"},
+        {"side": "ask", "price": "101", "size": "1.5"},
+    ]
+    assert book.pop_l2_changes() == []
+
+
+@pytest.mark.asyncio
+async def test_fok_sell_only_counts_acceptable_levels():
+    """Test a sell FOK ignores bid liquidity below its limit price."""
+    book = OrderBook("FOK3-USD")
+    for qty, price in (("1", "100"), ("1", "99"), ("5", "98")):
+        await book.submit_order(make_order("FOK3-USD", "buy", "limit", qty, price))
+
+    res = await book.submit_order(make_order("FOK3-USD", "sell", "fok", "3", "99"))
+    assert res["status"] == "canceled"
+    assert res["trades"] == []
+
+    res = await book.submit_order(make_order("FOK3-USD", "sell", "fok", "2", "99"))
+    assert res["status"] == "filled"
+    assert book.get_bbo()["best_bid"] == ("98", "5")